@@ -5,10 +5,16 @@ This file handles the tool log output to file and console
 
 import logging
 import logging.config
+import logging.handlers
 import os
 
+# Tool logger, shared with the scraper
+LOG = logging.getLogger('STD')
+
 LOG_FILENAME = 'weather_scraper.log'
 LOG_FILE_PERMISSION = 0o744
+# Number of records kept in memory before writing them to the log file
+LOG_BUFFER_CAPACITY = 1000
 
 
 def setup_logging(out_path):
@@ -38,19 +44,28 @@ def setup_logging(out_path):
                 'class': 'logging.FileHandler',
                 'filename': log_path
             },
+            # Batches records before writing them to the file, avoiding a write per record.
+            # Pending records are flushed on errors and on `logging.shutdown`, called at exit
+            'buffered_file': {
+                'level': 'INFO',
+                'class': 'logging.handlers.MemoryHandler',
+                'capacity': LOG_BUFFER_CAPACITY,
+                'flushLevel': logging.ERROR,
+                'target': 'file'
+            },
         },
         'loggers': {
             'STD': {
                 'level': 'DEBUG',
-                'handlers': ['file', 'console'],
+                'handlers': ['buffered_file', 'console'],
             },
         }
     })
-    logging.getLogger('STD').debug('Log dictConfig set')
+    LOG.debug('Log dictConfig set')
 
-    logging.getLogger('STD').debug('Updating log file permission')
+    LOG.debug('Updating log file permission')
     os.chmod(log_path, LOG_FILE_PERMISSION)
 
-    logging.getLogger('STD').debug('Log setup done')
+    LOG.debug('Log setup done')
 
-    logging.getLogger('STD').info('Log can be found at %s', log_path)
+    LOG.info('Log can be found at %s', log_path)
@@ -2,8 +2,12 @@
 ''' Output tests, in each version of their granularity '''
 
 import json
+from unittest import mock
 
-from ..weather_scraper import Measurement, Region, Scraper
+import pytest
+
+from ..weather_scraper import Measurement, Region, Scraper, json_default
+from .test_scraper import mocked_requests_get
 
 # Shuffled elements to check for consistent ordered outputs
 MEASUREMENT_DICT = {
@@ -78,7 +82,54 @@ def test_region():
     assert mock_json_str == expected_str
 
 
-def test_scraper_to_json():
+def test_region_raw_measurements():
+    ''' Test a Region instance holding raw measurement dicts, as filled by the scraper '''
+    mock_name = 'Test Region'
+    mock_instance = Region(mock_name)
+    mock_instance.measurements = [MEASUREMENT_DICT, Measurement(MEASUREMENT_DICT_2)]
+    assert dict(mock_instance) == {mock_name: [MEASUREMENT_DICT, MEASUREMENT_DICT_2]}
+
+    measurement_list = mock_instance.measurement_objects
+    assert all(isinstance(measurement, Measurement) for measurement in measurement_list)
+    assert [dict(measurement) for measurement in measurement_list] == [
+        MEASUREMENT_DICT, MEASUREMENT_DICT_2]
+
+
+def test_region_partial_raw():
+    ''' Test a Region instance holding a raw measurement dict with missing values '''
+    mock_name = 'Test Region'
+    mock_instance = Region(mock_name)
+    raw_measurement = {'rain': 3.33}
+    mock_instance.measurements = [raw_measurement]
+    mock_json_str = json.dumps(dict(mock_instance), sort_keys=True, indent=2)
+    expected_str = '''{
+  "Test Region": [
+    {
+      "humidity": 0,
+      "pressure": 0,
+      "rain": 3.33,
+      "temperature": 0,
+      "timestamp": 0,
+      "wind_direction": 0,
+      "wind_speed": 0
+    }
+  ]
+}'''
+    assert mock_json_str == expected_str
+
+    # The region data must not change through the iterated copies
+    dict(mock_instance)[mock_name][0]['rain'] = 0
+    assert raw_measurement == {'rain': 3.33}
+
+
+def test_json_default_unsupported():
+    ''' Test the JSON encoder hook refusing instances it does not know '''
+    with pytest.raises(TypeError):
+        json_default(object())
+
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_scraper_to_json(mock_get):
     ''' Test scraper object serialization into a JSON string '''
     region_a = Region('Test Region A')
     region_a.measurements = [Measurement(MEASUREMENT_DICT)]
@@ -125,3 +176,17 @@ def test_scraper_to_json():
   ]
 }'''
     assert mock_json_str == expected_str
+
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_scraper_to_json_partial_raw(mock_get):
+    ''' Test scraper serialization of raw measurement dicts with missing values '''
+    region = Region('Test Region')
+    region.measurements = [Measurement({'rain': 1}), {'rain': 2}]
+
+    mock_instance = Scraper()
+    mock_instance.regions = [region]
+    mock_json_str = mock_instance.to_json()
+
+    assert mock_json_str == json.dumps(dict(region), sort_keys=True, indent=2)
+    assert json.loads(mock_json_str)['Test Region'][1] == dict(Measurement({'rain': 2}))
@@ -3,32 +3,45 @@
 Big help from [Johannes Fahrenkrug](https://stackoverflow.com/a/28507806) to override the requests
 '''
 
+import io
 import os
 import unittest
 from unittest import mock
 
+import lxml.html
+
 from ..weather_scraper import Scraper, MAIN_URL, REGION_URL
 
 CURRENT_PATH = os.path.dirname(__file__)
 
 MOCKED_STATION_ID = 1000887
+MOCKED_XML_STATION_ID = 1000888
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+MOCKED_SHORT_ROW_STATION_ID = 1000889
 with open(os.path.join(CURRENT_PATH, 'main_url_one_region.html')) as file_handler:
     MAIN_URL_TEXT = file_handler.read()
 
 with open(os.path.join(CURRENT_PATH, 'region_url_text.html')) as file_handler:
     REGION_URL_TEXT = file_handler.read()
 
+# Same region page, without the last cell (pressure) of its first row
+SHORT_ROW_ROOT = lxml.html.fromstring(REGION_URL_TEXT)
+SHORT_ROW_CELL = SHORT_ROW_ROOT.xpath('//*[@id="tbTelemBody"]/tr[1]/td')[-1]
+SHORT_ROW_CELL.getparent().remove(SHORT_ROW_CELL)
+SHORT_ROW_REGION_URL_TEXT = lxml.html.tostring(SHORT_ROW_ROOT, encoding='unicode')
+
 with open(os.path.join(CURRENT_PATH, 'expected_str.json')) as file_handler:
     EXPECTED_STR = file_handler.read()
 
 
 def mocked_requests_get(*args, **kwargs):
-    ''' This method will be used by the mock to replace requests.get '''
+    ''' This method will be used by the mock to replace requests.Session.get '''
     class MockResponse:
-        ''' Mocks a requests.get response instance '''
+        ''' Mocks a requests.Session.get response instance '''
 
         def __init__(self, text, status_code):
             self.text = text
+            self.content = text.encode() if text is not None else None
             self.status_code = status_code
 
     if args[0] == MAIN_URL:
@@ -37,13 +50,19 @@ def mocked_requests_get(*args, **kwargs):
     if args[0] == REGION_URL.format(MOCKED_STATION_ID):
         return MockResponse(REGION_URL_TEXT, 200)
 
+    if args[0] == REGION_URL.format(MOCKED_SHORT_ROW_STATION_ID):
+        return MockResponse(SHORT_ROW_REGION_URL_TEXT, 200)
+
+    if args[0] == REGION_URL.format(MOCKED_XML_STATION_ID):
+        return MockResponse(XML_DECLARATION + REGION_URL_TEXT, 200)
+
     return MockResponse(None, 404)
 
 
 class ScraperTestCase(unittest.TestCase):
-    ''' The Scraper test case class, where we patch 'requests.get' with our own method. '''
+    ''' The Scraper test case class, where we patch 'requests.Session.get' with our own method. '''
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_fetch(self, mock_get):
         ''' Test one region measurements scrape '''
         mock_instance = Scraper()
@@ -51,3 +70,35 @@ class ScraperTestCase(unittest.TestCase):
 
         print(mock_instance.to_json())
         assert mock_instance.to_json() == EXPECTED_STR
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_dump_json(self, mock_get):
+        ''' Test one region measurements scrape written to a binary file '''
+        mock_instance = Scraper()
+        mock_instance.scrape_all()
+
+        output_file = io.BytesIO()
+        mock_instance.dump_json(output_file)
+        assert output_file.getvalue().decode() == EXPECTED_STR
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_fetch_xml_declaration(self, mock_get):
+        ''' Test a measurements page starting with an XML encoding declaration '''
+        mock_instance = Scraper()
+        measurements = mock_instance.fetch_measurements(('Test Region', MOCKED_XML_STATION_ID))
+
+        expected_measurements = mock_instance.fetch_measurements(
+            ('Test Region', MOCKED_STATION_ID))
+        assert measurements == expected_measurements
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_fetch_short_row(self, mock_get):
+        ''' Test a measurements table with a missing cell, which should default to zero '''
+        mock_instance = Scraper()
+        measurements = mock_instance.fetch_measurements(
+            ('Test Region', MOCKED_SHORT_ROW_STATION_ID))
+
+        expected_measurements = mock_instance.fetch_measurements(
+            ('Test Region', MOCKED_STATION_ID))
+        expected_measurements[0]['pressure'] = 0
+        assert measurements == expected_measurements
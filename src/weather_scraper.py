@@ -24,23 +24,36 @@ Author: Tales Lelo da Aparecida  -  Date: 18/12/2018
 '''
 
 import datetime
-import json
+import functools
+import io
 import logging
+import operator
+import sys
 import time
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from http.client import HTTPException
 
+import lxml.etree
+import lxml.html
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 try:
     from logger import setup_logging
 except ModuleNotFoundError:
     from .logger import setup_logging
 
+# Tool logger, configured by `setup_logging`
+LOG = logging.getLogger('STD')
+
 # Wait between request to avoid overwhelming the network
 FETCH_POLITELY = False
 
+# Maximum number of stations fetched at the same time
+MAX_WORKERS = 8
+
 # URL to fetch the station list
 MAIN_URL = 'https://www.cgesp.org/v3/estacoes-meteorologicas.jsp'
 
@@ -50,9 +63,19 @@ REGION_URL = 'https://www.saisp.br/geral/processo_cge.jsp?WHICHCHANNEL={}'
 # URL used to spoof the referer, allowing us to fetch the measurements table
 REFERER_URL = 'https://www.saisp.br'
 
-# Months list, used to convert tha table date to epoch
-MONTH_DICT = ['JAN', 'FEV', 'MAR', 'ABR', 'MAI',
-              'JUN', 'JUL', 'AGO', 'SET', 'OUT', 'NOV', 'DEZ']
+# Filter used to build only the stations list from the main page
+STATIONS_STRAINER = SoupStrainer('ul', {'id': 'lista-estacoes'})
+
+# Measurements table queries, compiled once and reused for every station
+HEADERS_XPATH = lxml.etree.XPath('//*[@id="tbDadosTelem"]/tr[1]/th')
+ROWS_XPATH = lxml.etree.XPath('//*[@id="tbDadosTelem"]//*[@id="tbTelemBody"]/tr')
+
+# Months names in order, used to convert tha table date to epoch
+MONTH_DICT = ('JAN', 'FEV', 'MAR', 'ABR', 'MAI',
+              'JUN', 'JUL', 'AGO', 'SET', 'OUT', 'NOV', 'DEZ')
+
+# Month number by its name, avoiding a linear scan on every conversion
+MONTH_INDEX = {month: number for number, month in enumerate(MONTH_DICT, 1)}
 
 # Attributes dictionary to translate a table column to our instance attr
 LABEL_DICT = {
@@ -65,6 +88,9 @@ LABEL_DICT = {
     'Pressão(mb)': 'pressure'
 }
 
+# LABEL_DICT keyed by the first 4 chars of each column, to tolerate badly formated headers
+PREFIX_LABEL_DICT = {key[:4]: label for key, label in LABEL_DICT.items()}
+
 # Expected bounderies for scraped values
 BOUNDS = {
     'timestamp': (0, 10**11),  # Enough seconds to last more than 3000 years
@@ -87,8 +113,10 @@ BOUNDS = {
 }
 
 
+@functools.lru_cache(maxsize=1024)
 def str_to_epoch(value):
-    ''' Converts a date string in the format 'DD MMM yyyy hh:mm' to a epoch timestamp integer
+    ''' Converts a date string in the format 'DD MMM yyyy hh:mm' to a epoch timestamp integer.
+    Results are cached, since every station table covers the same hours.
 
     Args:
         value (str): Datetime string formated as 'DD MMM yyyy hh:mm'
@@ -99,7 +127,7 @@ def str_to_epoch(value):
     '''
     day, month, year, hhmm = value.split()
     hour, minute = hhmm.split(':')
-    return int(datetime.datetime(int(year), MONTH_DICT.index(month)+1, int(day), int(hour),
+    return int(datetime.datetime(int(year), MONTH_INDEX[month], int(day), int(hour),
                                  int(minute)).timestamp())
 
 
@@ -113,10 +141,36 @@ def validate(value, label):
 
     start, end = BOUNDS[label]
     if not start <= value <= end:
-        logging.getLogger('STD').warning(
+        LOG.warning(
             '%s value outside expected interval [%.0f, %.0f]: %.2f', label, start, end, value)
 
 
+def parse_cell(cell, label):
+    ''' Converts a measurements table cell to the value of the given label, warning the user if
+    it is out of the expected interval
+
+    Args:
+        cell (lxml.html.HtmlElement): Table cell holding the value
+        label (str): Value identifier
+
+    Returns:
+        (number): The converted value, where an empty cell is coalesced to zero
+
+    '''
+    value = cell.text_content().strip()
+    if value == "":
+        value = 0
+
+    # Converts the value to the desired format
+    value = str_to_epoch(value) if label == 'timestamp' else float(value)
+
+    # Check the interval inline, calling `validate` only to warn about the rare misses
+    start, end = BOUNDS[label]
+    if not start <= value <= end:
+        validate(value, label)
+    return value
+
+
 class Measurement:
     ''' A weather measurement on a region
 
@@ -142,6 +196,9 @@ class Measurement:
 
     '''
 
+    __slots__ = ('timestamp', 'rain', 'wind_speed', 'wind_direction', 'temperature', 'humidity',
+                 'pressure')
+
     def __init__(self, measurement_dict):
         self.timestamp = measurement_dict.get('timestamp', 0)
         self.rain = measurement_dict.get('rain', 0)
@@ -153,31 +210,34 @@ class Measurement:
 
     def __iter__(self):
         ''' Yields instance attributes as (key,value)<str,number> tuples '''
-        attrs = {
-            'timestamp': self.timestamp,
-            'rain': self.rain,
-            'wind_speed': self.wind_speed,
-            'wind_direction': self.wind_direction,
-            'temperature': self.temperature,
-            'humidity': self.humidity,
-            'pressure': self.pressure
-        }
-        for key, value in attrs.items():
-            yield (key, value)
+        return zip(MEASUREMENT_ATTRS, MEASUREMENT_GETTER(self))
+
+    def as_dict(self):
+        ''' Returns the instance attributes as a plain dict, ready to be serialized '''
+        return dict(self)
 
     def __str__(self):
-        result_dict = dict(self)
-        result_dict['timestamp'] = str(datetime.datetime.fromtimestamp(
-            result_dict['timestamp']))
         return '\t'.join([
-            '{timestamp}',
-            'Rain: {rain:5.2f}mm',
-            'Wind speed: {wind_speed:5.2f}m/s',
-            'Wind direction: {wind_direction:5.2f}º',
-            'Temperature: {temperature:5.2f}ºC',
-            'Humidity: {humidity:5.2f}%',
-            'Pressure: {pressure:5.2f}mbar',
-        ]).format(**result_dict)
+            str(datetime.datetime.fromtimestamp(self.timestamp)),
+            f'Rain: {self.rain:5.2f}mm',
+            f'Wind speed: {self.wind_speed:5.2f}m/s',
+            f'Wind direction: {self.wind_direction:5.2f}º',
+            f'Temperature: {self.temperature:5.2f}ºC',
+            f'Humidity: {self.humidity:5.2f}%',
+            f'Pressure: {self.pressure:5.2f}mbar',
+        ])
+
+
+# Measurement attribute names and a getter returning all their values at once, in the same order
+MEASUREMENT_ATTRS = Measurement.__slots__
+MEASUREMENT_GETTER = operator.attrgetter(*MEASUREMENT_ATTRS)
+# Raw measurement attributes with every value coalesced to zero, as done by `Measurement`
+MEASUREMENT_DEFAULTS = dict.fromkeys(MEASUREMENT_ATTRS, 0)
+
+
+def is_partial(measurement):
+    ''' Returns whether the measurement is a raw dict missing some of the attributes '''
+    return isinstance(measurement, dict) and not MEASUREMENT_DEFAULTS.keys() <= measurement.keys()
 
 
 class Region:
@@ -188,7 +248,9 @@ class Region:
 
     Attributes:
         name (str): Region identifier
-        measurements (list of Measurement)
+        measurements (list of dict or Measurement): Scraped measurements are kept as their raw
+            attributes dict, the same accepted by `Measurement`, which is only built on demand.
+            Missing values of assigned raw dicts are coalesced to zero once, on assignment
 
     '''
 
@@ -196,13 +258,50 @@ class Region:
         self.name = name.strip()
         self.measurements = []
 
+    @property
+    def measurements(self):
+        ''' (list of dict or Measurement): The region measurements '''
+        return self._measurements
+
+    @measurements.setter
+    def measurements(self, measurement_list):
+        # Coalesce missing values to zero just like `Measurement`, copying only partial dicts
+        self._measurements = [
+            dict(MEASUREMENT_DEFAULTS, **measurement) if is_partial(measurement) else measurement
+            for measurement in measurement_list]
+
     def __iter__(self):
+        # Yield copies, so the region data can not be changed through them
         yield (self.name, [dict(measurement) for measurement in self.measurements])
 
+    @property
+    def measurement_objects(self):
+        ''' (list of Measurement): The region measurements, wrapped in `Measurement` instances '''
+        return [measurement if isinstance(measurement, Measurement) else Measurement(measurement)
+                for measurement in self.measurements]
+
     def __str__(self):
         return 'Region "{}": {} measurements'.format(self.name, len(self.measurements))
 
 
+def json_default(obj):
+    ''' Converts the instances the JSON encoder can not serialize by itself
+
+    Args:
+        obj (object): Instance found by the encoder
+
+    Returns:
+        (dict): A serializable version of the instance
+
+    Raises:
+        TypeError: If the instance type is not supported
+
+    '''
+    if isinstance(obj, Measurement):
+        return obj.as_dict()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
 class Scraper:
     '''
     Serializes the weather measurements for all meteorological stations
@@ -210,37 +309,42 @@ class Scraper:
     Attributes:
         stations (list of (str, str)): List of pairs of region name and station id
         regions (list of Region): Stores all fetched and parsed instances
-        response_delay (int): Seconds taken in the last request
+        session (requests.Session): Shared HTTP session, reusing connections between requests
+        response_delay (int): Seconds taken in the last request, kept only when FETCH_POLITELY
     '''
 
     def __init__(self):
         self.regions = []
         self.response_delay = 0
+        # Keep the connection alive between requests, with the referer needed by the region URL
+        self.session = requests.Session()
+        self.session.headers.update({'referer': REFERER_URL})
         # Fills regions based on the main URL menu stations list
         self.fetch_stations()
 
     def fetch_stations(self):
         ''' Returns a list of tuples (name, address) of meteorological stations '''
-        logging.getLogger('STD').info('Fetching stations')
-        logging.getLogger('STD').debug('[GET] %s', MAIN_URL)
-        request = requests.get(MAIN_URL)
+        LOG.info('Fetching stations')
+        LOG.debug('[GET] %s', MAIN_URL)
+        request = self.session.get(MAIN_URL)
 
         if request.status_code != 200:
             raise HTTPException(request.status_code)
 
-        root = BeautifulSoup(request.text, "html.parser")
-        # Get the station names and ids from the items on the list identified by 'lista-estacoes'
+        # Parse only the list identified by 'lista-estacoes', skipping the rest of the page
+        root = BeautifulSoup(request.text, "lxml", parse_only=STATIONS_STRAINER)
+        # Get the station names and ids from the items on the list
         self.stations = [(item.text, item.a.attrs['href'].split('=')[1])
-                         for item in root.find('ul', {'id': 'lista-estacoes'}).find_all('li')]
+                         for item in root.find_all('li')]
 
-        logging.getLogger('STD').info(
+        LOG.info(
             '%0d station(s) found', len(self.stations))
 
     def fetch_measurements(self, station):
-        ''' Returns a `Region` instance with values based on the station at the passed index '''
+        ''' Returns a list of raw measurement dicts, as kept by `Region`, for the passed station '''
         station_id = station[1]
 
-        logging.getLogger('STD').debug(
+        LOG.debug(
             '[GET] %s %s', REGION_URL.format(station_id), str({'referer': REFERER_URL}))
 
         # wait 10x longer than it took them to respond to avoid overwhelming the network
@@ -250,46 +354,58 @@ class Scraper:
         # Store current time to calculate delay
         request_start = time.time()
 
-        # Request the measurement table with the station URL as the referer
-        request = requests.get(REGION_URL.format(station_id),
-                               headers={'referer': REFERER_URL})
-        self.response_delay = time.time() - request_start
+        # Request the measurement table, the session already sends the required referer
+        request = self.session.get(REGION_URL.format(station_id))
+        response_delay = time.time() - request_start
+        LOG.debug('Station %s responded in %.2fms', station_id, 1000 * response_delay)
+        # Only polite fetches, run one at a time, depend on the last delay
+        if FETCH_POLITELY:
+            self.response_delay = response_delay
 
         if request.status_code != 200:
             raise HTTPException(request.status_code)
 
-        root = BeautifulSoup(request.text, "html.parser")
+        # Only tabular data is needed here, so parse it with lxml directly. The raw bytes are
+        # passed to let libxml2 handle the page encoding, including any XML declaration
+        root = lxml.html.fromstring(request.content)
 
         # Get a list from the headers to match their order later
-        label_list = [row.text for row in root.select_one(
-            '#tbDadosTelem > tr').find_all('th')]
+        label_list = [header.text_content() for header in HEADERS_XPATH(root)]
+        # Resolve each column label once, matching only the first 4 chars on the dictionary to
+        # avoid badly formated headers. Unknown columns are kept as None to be skipped
+        column_labels = [PREFIX_LABEL_DICT.get(key[:4]) for key in label_list]
 
         measurements = []
-        for row in root.select('#tbDadosTelem #tbTelemBody > tr'):
-            row_attrs = {}
-            # Iters throught table keys and values, filtering out empty lines from the row
-            for key, value in zip(label_list, row.findChildren("td", recursive=False)):
-                value = value.text.strip()
-                if value == "":
-                    value = 0
-                # Match only the first 4 chars on the dictionary to avoid badly formated headers
-                label = next(
-                    (LABEL_DICT[_key] for _key in LABEL_DICT if _key[:4] == key[:4]), None)
-
+        for row in ROWS_XPATH(root):
+            row_attrs = dict(MEASUREMENT_DEFAULTS)
+            # Iters throught table labels and the row cells, values of missing cells stay zero
+            for label, cell in zip(column_labels, row.findall('td')):
                 # Skip unknown labels
-                if label is None:
-                    continue
+                if label is not None:
+                    row_attrs[label] = parse_cell(cell, label)
+            measurements.append(row_attrs)
 
-                # Converts the value to the desired format
-                value = str_to_epoch(
-                    value) if label == 'timestamp' else float(value)
+        return measurements
 
-                # Check and warn if the value is not in a valid interval
-                validate(value, label)
-                row_attrs[label] = value
-            measurements.append(Measurement(row_attrs))
+    def fetch_region(self, number, station):
+        ''' Returns a `Region` instance filled with the measurements of the passed station
 
-        return measurements
+            Args:
+                number (int): Station position on the list, used only for logging
+                station ((str, str)): Pair of region name and station id
+
+        '''
+        LOG.info('Fetching region #%d', number)
+
+        # Initialize a region instance with the current station name
+        region = Region(station[0])
+
+        # Fetch measurements from the table
+        region.measurements = self.fetch_measurements(station)
+
+        LOG.debug('Got %s', str(region))
+
+        return region
 
     def scrape_next(self):
         ''' Scrap the URL searching for a new region
@@ -298,43 +414,66 @@ class Scraper:
                 (Region): Region instance with all its measurements
 
         '''
-        count = 0
-        for station in self.stations:
-            logging.getLogger('STD').info('Fetching region #%d', count+1)
-
-            # Initialize a region instance with the current station name
-            region = Region(station[0])
+        for number, station in enumerate(self.stations, 1):
+            yield self.fetch_region(number, station)
 
-            # Fetch measurements from the table
-            region.measurements = self.fetch_measurements(station)
-            count += 1
+    def scrape_all(self):
+        ''' Fills the regions list with all stations measurements, fetching them concurrently '''
+        # Polite fetches depend on the previous response delay, so they must run one at a time
+        max_workers = 1 if FETCH_POLITELY else MAX_WORKERS
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # `map` keeps the stations order, giving a deterministic output
+            self.regions.extend(executor.map(
+                self.fetch_region, range(1, len(self.stations) + 1), self.stations))
 
-            logging.getLogger('STD').debug(
-                'Got %s in %.2fms', str(region), self.response_delay)
+    def to_json_bytes(self):
+        '''Returns the UTF-8 encoded JSON with sorted keys with all measurements for all regions
 
-            yield region
+        Encoded by orjson, NaN and infinite values are written as `null`, keeping the JSON valid
 
-    def scrape_all(self):
-        ''' Fills the regions list with all stations measurements '''
-        for reg in self.scrape_next():
-            self.regions.append(reg)
+        '''
+        file_handler = io.BytesIO()
+        self.dump_json(file_handler)
+        return file_handler.getvalue()
 
     def to_json(self):
-        '''Returns a JSON string with sorted keys with all measurements for all regions'''
-        regions_dict = {}
-        for region in self.regions:
-            regions_dict.update(dict(region))
-        return json.dumps(regions_dict, sort_keys=True, indent=2, ensure_ascii=False)
+        '''Returns the same JSON as `to_json_bytes`, as a string'''
+        return self.to_json_bytes().decode()
+
+    def dump_json(self, file_handler):
+        '''Writes the same JSON as `to_json_bytes` to a binary file-like object, region by region,
+        so only one region is encoded in memory at a time
+
+        Args:
+            file_handler (file): Binary stream where the JSON is written
+
+        '''
+        # Measurements are left for the encoder to convert while it walks each region
+        regions_dict = {region.name: region.measurements for region in self.regions}
+        if not regions_dict:
+            file_handler.write(b'{}')
+            return
+
+        separator = b'{\n  '
+        for name in sorted(regions_dict):
+            file_handler.write(separator + orjson.dumps(name) + b': ')
+            # Indent the region list one level deeper, as encoded strings never hold line breaks
+            file_handler.write(orjson.dumps(
+                regions_dict[name], default=json_default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2).replace(b'\n', b'\n  '))
+            separator = b',\n  '
+        file_handler.write(b'\n}')
 
 
 if __name__ == "__main__":
     setup_logging(tempfile.gettempdir())
 
-    logging.getLogger('STD').info('Starting scraper')
+    LOG.info('Starting scraper')
 
     SCRAPER = Scraper()
     SCRAPER.scrape_all()
 
-    logging.getLogger('STD').info('Finished scraping')
+    LOG.info('Finished scraping')
 
-    print(SCRAPER.to_json())
+    SCRAPER.dump_json(sys.stdout.buffer)
+    sys.stdout.buffer.write(b'\n')